@@ -12,10 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-from itertools import count
-from random import randint, shuffle
+from base64 import b64encode
+from itertools import count, chain
+from random import randint, sample
 import gzip
-import json
 import os
 from os.path import isfile, basename
 from sklearn.svm import LinearSVC
@@ -24,7 +24,8 @@ import numpy as np
 from microtc.utils import tweet_iterator, Counter
 import encexp
 from encexp.text_repr import SeqTM
-from encexp.utils import progress_bar
+from encexp.utils import progress_bar, update_counter, json_dumps
+from encexp.utils import BATCH_SIZE, COMPRESSLEVEL
 
 
 def encode_output(fname, prefix='encode'):
@@ -65,23 +66,31 @@ def encode(vocabulary:dict, fname: str, tokens: list=None,
     seq = update_tokens(SeqTM(vocabulary=vocabulary),
                         tokens=tokens)
     tokenize = seq.tokenize
+    get_text = seq.get_text
     cnt = Counter()
-    with open(output, 'w', encoding='utf-8') as fpt:
+    batch = []
+    with open(output, 'wb') as fpt:
         for tweet, _ in progress_bar(zip(tweet_iterator(fname), loop),
                                      total=limit,
                                      desc=output):
-            _ = tokenize(tweet)
-            cnt.update(_)
-            print(json.dumps(_), file=fpt)
+            _ = tokenize(get_text(tweet))
+            batch.append(_)
+            fpt.write(json_dumps(_) + b'\n')
+            if len(batch) == BATCH_SIZE:
+                update_counter(cnt, batch)
+    update_counter(cnt, batch)
     return output, cnt
 
 
 def feasible_tokens(vocabulary: dict, count: dict,
                     tokens: list=None,
                     min_pos: int=512):
-    """Feasible tokens"""
-    seq = SeqTM(vocabulary=vocabulary)
-    tokens = seq.names if tokens is None else tokens
+    """Feasible tokens; vocabulary can be a SeqTM instance"""
+    if tokens is None:
+        seq = vocabulary
+        if not isinstance(seq, SeqTM):
+            seq = SeqTM(vocabulary=vocabulary)
+        tokens = seq.names
     output = []
     for k, v in enumerate(tokens):
         if count[v] < min_pos:
@@ -90,42 +99,77 @@ def feasible_tokens(vocabulary: dict, count: dict,
     return output
 
 
-def build_encexp_token(index, vocabulary,
-                       fname, max_pos=2**13,
-                       precision=np.float16,
-                       transform=None,
-                       estimator_kwargs=None,
-                       label=None):
-    """Build token classifier"""
-    seq = SeqTM(vocabulary=vocabulary)
-    output_fname = encode_output(fname, prefix=f'{index}')
-    POS = []
-    NEG = []
+def collect_examples(fname, labels, max_pos=2**13):
+    """Positive and negative examples of each label
+    collected in a single pass over the encoded file"""
+    POS = {label: [] for label in labels}
+    NEG = {label: [] for label in labels}
+    active = list(labels)
+    for text in tweet_iterator(fname):
+        complete = False
+        text_set = set(text)
+        for label in active:
+            pos = POS[label]
+            neg = NEG[label]
+            if label in text_set:
+                pos.append([x for x in text if x != label])
+            elif len(neg) - len(pos) < 1024:
+                neg.append(text)
+            else:
+                k = randint(0, len(neg) - 1)
+                neg[k] = neg[-1]
+                neg.pop()
+            if len(pos) > max_pos:
+                complete = True
+        if complete:
+            active = [label for label in active
+                      if len(POS[label]) <= max_pos]
+            if len(active) == 0:
+                break
+    return {label: (POS[label], NEG[label]) for label in labels}
+
 
+def built_token(index, fname):
+    """Filename of the token classifier if it is already built"""
+    output_fname = encode_output(fname, prefix=f'{index}')
     if isfile(output_fname):
         try:
             next(tweet_iterator(output_fname))
             return output_fname
         except Exception:
             pass
-    for text in tweet_iterator(fname):
-        if label in text:
-            POS.append([x for x in text if x != label])
-        elif len(NEG) - len(POS) < 1024:
-            NEG.append(text)
-        else:
-            k = randint(0, len(NEG) - 1)
-            del NEG[k]
-        if len(POS) > max_pos:
-            break
+    return None
+
+
+def build_encexp_token(index, vocabulary,
+                       fname, max_pos=2**13,
+                       precision=np.float16,
+                       transform=None,
+                       estimator_kwargs=None,
+                       label=None,
+                       examples=None):
+    """Build token classifier; vocabulary can be a SeqTM instance
+    to avoid building it on every call, and examples the pair
+    (POS, NEG) computed with :py:func:`collect_examples`"""
+    output_fname = built_token(index, fname)
+    if output_fname is not None:
+        return output_fname
+    output_fname = encode_output(fname, prefix=f'{index}')
+    if examples is None:
+        examples = collect_examples(fname, [label],
+                                    max_pos=max_pos)[label]
+    POS, NEG = examples
     if len(POS) == 0 or len(NEG) == 0:
         return None
-    shuffle(NEG)
-    NEG = NEG[:len(POS)]
+    NEG = sample(NEG, min(len(NEG), len(POS)))
     if transform is not None:
         X = transform(POS + NEG)
     else:
-        X = seq.tonp([seq.model[x] for x in POS + NEG])
+        seq = vocabulary
+        if not isinstance(seq, SeqTM):
+            seq = SeqTM(vocabulary=vocabulary, precision=np.float64)
+        model = seq.model
+        X = seq.tonp([model[x] for x in chain(POS, NEG)])
     y = [1] * len(POS) + [0] * len(NEG)
     est_kwargs = dict(class_weight='balanced',
                       fit_intercept=False,
@@ -135,42 +179,68 @@ def build_encexp_token(index, vocabulary,
     m = LinearSVC(**est_kwargs).fit(X, y)
     coef = m.coef_[0].astype(precision)
     with open(output_fname, 'wb') as fpt:
-        output = dict(N=len(y), coef=coef.tobytes().hex(),
+        output = dict(N=len(y),
+                      coef_b64=b64encode(coef.tobytes()).decode('ascii'),
                       intercept=float(m.intercept_), label=label)
-        fpt.write(bytes(json.dumps(output), encoding='utf-8'))
+        fpt.write(json_dumps(output))
     return output_fname
 
 
+def build_encexp_block(block, vocabulary, fname,
+                       max_pos=2**13, **kwargs):
+    """Build the token classifiers of `block`, a list of pairs
+    (index, label); the examples are collected in a single pass
+    over the encoded file"""
+    output = [built_token(index, fname) for index, _ in block]
+    labels = [label for (_, label), done in zip(block, output)
+              if done is None]
+    if len(labels) == 0:
+        return output
+    examples = collect_examples(fname, list(dict.fromkeys(labels)),
+                                max_pos=max_pos)
+    for k, (index, label) in enumerate(block):
+        if output[k] is not None:
+            continue
+        output[k] = build_encexp_token(index, vocabulary, fname,
+                                       max_pos=max_pos, label=label,
+                                       examples=examples[label],
+                                       **kwargs)
+    return output
+
+
 def build_encexp(vocabulary, fname, output,
                  min_pos: int=512, max_pos: int=2**13,
                  n_jobs: int = -1, precision=np.float16,
                  estimator_kwargs: dict=None, limit: int=None,
-                 transform=None, tokens: list=None):
-    """Build EncExp"""
-    encode_fname, cnt = encode(vocabulary, fname, tokens=tokens, 
-                               limit=limit)
-    tokens = feasible_tokens(vocabulary, cnt, tokens=tokens,
+                 transform=None, tokens: list=None,
+                 block_size: int=2**5):
+    """Build EncExp; each job builds `block_size` tokens,
+    collecting their examples in a single pass over the encoded file"""
+    encode_fname, cnt = encode(vocabulary, fname,
+                               tokens=tokens, limit=limit)
+    seq = SeqTM(vocabulary=vocabulary, precision=np.float64)
+    tokens = feasible_tokens(seq, cnt, tokens=tokens,
                              min_pos=min_pos)
-    fnames = Parallel(n_jobs=n_jobs)(delayed(build_encexp_token)(index,
-                                                                 vocabulary,
-                                                                 encode_fname,
-                                                                 precision=precision,
-                                                                 max_pos=max_pos,
-                                                                 estimator_kwargs=estimator_kwargs,
-                                                                 transform=transform,
-                                                                 label=label)
-                                     for index, label in progress_bar(tokens,
-                                                                  desc=output,
-                                                                  total=len(tokens)))
-    with gzip.open(output, 'wb') as fpt:
-        fpt.write(bytes(json.dumps(vocabulary) + '\n',
-                        encoding='utf-8'))
+    blocks = [tokens[start:start + block_size]
+              for start in range(0, len(tokens), block_size)]
+    _ = Parallel(n_jobs=n_jobs)(delayed(build_encexp_block)(block,
+                                                            seq,
+                                                            encode_fname,
+                                                            max_pos=max_pos,
+                                                            precision=precision,
+                                                            estimator_kwargs=estimator_kwargs,
+                                                            transform=transform)
+                                for block in progress_bar(blocks,
+                                                          desc=output,
+                                                          total=len(blocks)))
+    fnames = list(chain.from_iterable(_))
+    with gzip.open(output, 'wb', compresslevel=COMPRESSLEVEL) as fpt:
+        fpt.write(json_dumps(vocabulary) + b'\n')
         for fname in fnames:
             if fname is None:
                 continue
-            data = next(tweet_iterator(fname))
-            fpt.write(bytes(json.dumps(data) + '\n',
-                            encoding='utf-8'))
+            with open(fname, 'rb') as token_fpt:
+                fpt.write(token_fpt.read().strip() + b'\n')
     for fname in fnames:
         if fname is None:
             continue        
@@ -13,9 +13,9 @@
 # limitations under the License.
 
 import argparse
-import json
 import gzip
 from encexp.utils import compute_b4msa_vocabulary, compute_seqtm_vocabulary
+from encexp.utils import COMPRESSLEVEL, json_dumps
 from encexp.text_repr import SeqTM
 import encexp
 
@@ -23,19 +23,21 @@ import encexp
 def build_voc(filename, lang='es',
               voc_size_exponent=13,
               limit=None, output=None,
-              **kwargs):
+              n_jobs=1, **kwargs):
     """Build vocabulary"""
-    data = compute_b4msa_vocabulary(filename, limit=limit, lang=lang)
+    data = compute_b4msa_vocabulary(filename, limit=limit, lang=lang,
+                                    n_jobs=n_jobs)
     voc = compute_seqtm_vocabulary(SeqTM, data, filename, limit=limit,
                                    voc_size_exponent=voc_size_exponent,
-                                   **kwargs)
+                                   n_jobs=n_jobs, **kwargs)
     seqtm = SeqTM(lang=lang, voc_size_exponent=voc_size_exponent,
                   vocabulary=voc)
     output_filename = output
     if output_filename is None:
         output_filename = seqtm.identifier + '.json.gz'
-    with gzip.open(output_filename, 'wb') as fpt:
-        fpt.write(bytes(json.dumps(voc), encoding='utf-8'))
+    with gzip.open(output_filename, 'wb',
+                   compresslevel=COMPRESSLEVEL) as fpt:
+        fpt.write(json_dumps(voc))
     
 
 def main(args):
@@ -45,6 +47,7 @@ def main(args):
     build_voc(filename, lang=args.lang,
               voc_size_exponent=args.voc_size_exponent,
               limit=args.limit, output=args.output,
+              n_jobs=getattr(args, 'n_jobs', 1),
               prefix_suffix=args.prefix_suffix)
 
 
@@ -68,6 +71,9 @@ if __name__ == '__main__':
     parser.add_argument('--prefix-suffix', 
                         help='Restric to use prefix and suffix',
                         dest='prefix_suffix', action='store_true')
+    parser.add_argument('--n-jobs',
+                        help='Number of jobs',
+                        dest='n_jobs', type=int, default=1)
     parser.add_argument('file',
                         help='Input filename',
                         nargs=1, type=str)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
+from base64 import b64decode
 from encexp.utils import Download, MODELS, EncExp_URL
 from microtc.utils import tweet_iterator
 from os.path import isdir, isfile, join
@@ -45,6 +46,21 @@ def download_seqtm(lang, voc_size_exponent: int=13,
     return next(tweet_iterator(output))
 
 
+def read_encexp(output, precision):
+    """Read EncExp"""
+    iter_ = tweet_iterator(output)
+    params = next(iter_)
+    coefs = []
+    for coef in iter_:
+        if 'coef_b64' in coef:
+            _ = b64decode(coef.pop('coef_b64'))
+        else:
+            _ = bytearray.fromhex(coef['coef'])
+        coef['coef'] = np.frombuffer(_, dtype=precision)
+        coefs.append(coef)
+    return dict(seqtm=params, coefs=coefs)
+
+
 def download_encexp(lang='es', voc_size_exponent: int=13,
                     precision=np.float16, voc_source='noGeo',
                     enc_source='mix', output=None,
@@ -52,15 +68,7 @@ def download_encexp(lang='es', voc_size_exponent: int=13,
                     intercept=False):
     """Download EncExp"""
     def read(output):
-        iter_ = tweet_iterator(output)
-        params = next(iter_)
-        coefs = []
-        for coef in iter_:
-            _ = np.frombuffer(bytearray.fromhex(coef['coef']),
-                              dtype=precision)
-            coef['coef'] = _
-            coefs.append(coef)
-        return dict(seqtm=params, coefs=coefs)
+        return read_encexp(output, precision)
 
     if not isdir(MODELS):
         os.mkdir(MODELS)
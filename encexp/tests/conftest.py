@@ -0,0 +1,95 @@
+# Copyright 2024 Mario Graff (https://github.com/mgraffg)
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from copy import deepcopy
+from functools import lru_cache
+import os
+import pytest
+from microtc.utils import tweet_iterator
+from encexp.tests.test_utils import samples
+from encexp.utils import compute_b4msa_vocabulary, compute_seqtm_vocabulary
+from encexp.text_repr import SeqTM
+from encexp import download
+from encexp.download import download_seqtm
+from encexp.build_encexp import build_encexp
+
+
+@pytest.fixture(scope='session')
+def encexp_models():
+    """Decoded EncExp models kept during the test session"""
+    read = download.read_encexp
+
+    @lru_cache(maxsize=4)
+    def cached(output, precision, stamp):
+        return read(output, precision)
+
+    yield cached
+    cached.cache_clear()
+
+
+@pytest.fixture
+def encexp_cache(monkeypatch, encexp_models):
+    """download_encexp reads the models through encexp_models"""
+
+    def read_encexp(output, precision):
+        stat = os.stat(output)
+        data = encexp_models(output, precision,
+                             (stat.st_mtime_ns, stat.st_size))
+        return dict(seqtm=deepcopy(data['seqtm']),
+                    coefs=[dict(coef) for coef in data['coefs']])
+
+    monkeypatch.setattr(download, 'read_encexp', read_encexp)
+
+
+@pytest.fixture(scope='session')
+def es_mx_voc():
+    """SeqTM vocabulary of the MX sample computed once per session"""
+    samples()
+    data = compute_b4msa_vocabulary('es-mx-sample.json')
+    return compute_seqtm_vocabulary(SeqTM, data,
+                                    'es-mx-sample.json',
+                                    voc_size_exponent=10)
+
+
+def _sample(country):
+    """Tweets of the sample of `country`"""
+    samples(filename=f'es-{country}-sample.json.zip')
+    return list(tweet_iterator(f'es-{country}-sample.json'))
+
+
+@pytest.fixture(scope='session')
+def mx_sample():
+    """MX sample"""
+    return _sample('mx')
+
+
+@pytest.fixture(scope='session')
+def ar_sample():
+    """AR sample"""
+    return _sample('ar')
+
+
+@pytest.fixture(scope='session')
+def es_sample():
+    """ES sample"""
+    return _sample('es')
+
+
+@pytest.fixture(scope='session')
+def encexp_es_mx(tmp_path_factory):
+    """EncExp built on the MX sample with the Spanish vocabulary"""
+    voc = download_seqtm(lang='es')
+    samples()
+    output = tmp_path_factory.mktemp('encexp') / 'encexp-es-mx.json.gz'
+    build_encexp(voc, 'es-mx-sample.json', str(output), min_pos=64)
+    return str(output)
@@ -16,9 +16,11 @@ from encexp.tests.test_utils import samples
 from encexp.utils import compute_b4msa_vocabulary, compute_seqtm_vocabulary
 from encexp.text_repr import SeqTM, EncExp
 from encexp.build_encexp import encode_output, encode, feasible_tokens, build_encexp_token, build_encexp
+from encexp.build_encexp import collect_examples, build_encexp_block
 from encexp.build_voc import main, build_voc
 from os.path import isfile
 import os
+import json
 
 
 def test_seqtm_build():
@@ -50,13 +52,9 @@ def test_build_voc():
     os.unlink('t.json.gz')
 
 
-def test_encexp_encode():
+def test_encexp_encode(es_mx_voc):
     """Test encode method"""
-    samples()
-    data = compute_b4msa_vocabulary('es-mx-sample.json')
-    voc = compute_seqtm_vocabulary(SeqTM, data,
-                                   'es-mx-sample.json',
-                                   voc_size_exponent=10)
+    voc = es_mx_voc
     output, cnt = encode(voc, 'es-mx-sample.json')
     assert isfile(output)
     assert output == 'encode-es-mx-sample.json'
@@ -71,26 +69,18 @@ def test_encexp_encode_output():
     assert output == '/data/encode-bla.json'
 
 
-def test_feasible_tokens():
+def test_feasible_tokens(es_mx_voc):
     """Test feasible tokens"""
-    samples()
-    data = compute_b4msa_vocabulary('es-mx-sample.json')
-    voc = compute_seqtm_vocabulary(SeqTM, data,
-                                   'es-mx-sample.json',
-                                   voc_size_exponent=10)
+    voc = es_mx_voc
     output, cnt = encode(voc, 'es-mx-sample.json')
     tokens = feasible_tokens(voc, cnt)
     assert len(tokens) == 11
     os.unlink('encode-es-mx-sample.json')
 
 
-def test_build_encexp_token():
+def test_build_encexp_token(es_mx_voc):
     """Test build token classifier"""
-    samples()
-    data = compute_b4msa_vocabulary('es-mx-sample.json')
-    voc = compute_seqtm_vocabulary(SeqTM, data,
-                                   'es-mx-sample.json',
-                                   voc_size_exponent=10)
+    voc = es_mx_voc
     output, cnt = encode(voc, 'es-mx-sample.json')
     tokens = feasible_tokens(voc, cnt)
     index, token = tokens[-3]
@@ -102,6 +92,38 @@ def test_build_encexp_token():
     os.unlink(fname)
 
 
+def test_build_encexp_block(es_mx_voc):
+    """Test build the token classifiers of a block"""
+    output, cnt = encode(es_mx_voc, 'es-mx-sample.json')
+    block = feasible_tokens(es_mx_voc, cnt)[-3:]
+    fnames = build_encexp_block(block + block[-1:], es_mx_voc, output)
+    assert len(fnames) == len(block) + 1
+    assert build_encexp_block(block, es_mx_voc, output) == fnames[:-1]
+    fnames = fnames[:-1]
+    os.unlink(output)
+    for (_, token), fname in zip(block, fnames):
+        if fname is None:
+            continue
+        assert next(tweet_iterator(fname))['label'] == token
+        os.unlink(fname)
+
+
+def test_collect_examples(tmp_path):
+    """Test collect examples in a single pass"""
+    fname = str(tmp_path / 't-encode.json')
+    with open(fname, 'w', encoding='utf-8') as fpt:
+        for text in [['a', 'b'], ['b', 'c'], ['a', 'c'], ['c']]:
+            print(json.dumps(text), file=fpt)
+    examples = collect_examples(fname, ['a', 'b'])
+    POS, NEG = examples['a']
+    assert POS == [['b'], ['c']]
+    assert NEG == [['b', 'c'], ['c']]
+    POS, NEG = examples['b']
+    assert POS == [['a'], ['c']]
+    examples = collect_examples(fname, ['a'], max_pos=0)
+    assert examples['a'][0] == [['b']]
+
+
 def test_build_encexp():
     """Test build encexp"""
     samples()
@@ -120,15 +142,11 @@ def test_build_encexp():
     assert len(tokens_w - tokens) == 0
 
 
-def test_build_encexp_estimator_kwargs():
+def test_build_encexp_estimator_kwargs(es_mx_voc):
     """Test build encexp with estimator_kwargs"""
     import numpy as np
     from encexp.text_repr import EncExp
-    samples()
-    data = compute_b4msa_vocabulary('es-mx-sample.json')
-    voc = compute_seqtm_vocabulary(SeqTM, data,
-                                   'es-mx-sample.json',
-                                   voc_size_exponent=10)
+    voc = es_mx_voc
     build_encexp(voc, 'es-mx-sample.json', 'encexp-es-mx.json.gz',
                  estimator_kwargs=dict(fit_intercept=True))
     assert isfile('encexp-es-mx.json.gz')
@@ -15,7 +15,6 @@ from os.path import isfile
 import numpy as np
 from numpy.testing import assert_almost_equal
 import os
-from microtc.utils import tweet_iterator
 from encexp.tests.test_utils import samples
 from encexp.utils import compute_b4msa_vocabulary, compute_seqtm_vocabulary
 from encexp.build_encexp import build_encexp
@@ -39,6 +38,28 @@ def test_seqtm():
     assert _ == ['buenos', 'dias', 'q:~mx', 'q:ei', 'q:co~']
 
 
+def test_seqtm_tokens_cache():
+    """Test SeqTM tokens cache"""
+    import pickle
+
+    seqtm = SeqTM(lang='es', voc_size_exponent=13)
+    text = '~buenos~dias~'
+    tokens = seqtm.compute_tokens(text)
+    assert len(seqtm.tokens_cache) == 0
+    seqtm.cache_size = 2
+    assert seqtm.compute_tokens(text) == tokens
+    assert text in seqtm.tokens_cache
+    tokens[0].append('x')
+    assert seqtm.compute_tokens(text) == [tokens[0][:-1]]
+    seqtm.compute_tokens('~buenos~')
+    seqtm.compute_tokens(text)
+    seqtm.compute_tokens('~dias~')
+    assert list(seqtm.tokens_cache) == [text, '~dias~']
+    assert len(pickle.loads(pickle.dumps(seqtm)).tokens_cache) == 0
+    seqtm.data_structure = seqtm.data_structure
+    assert len(seqtm.tokens_cache) == 0
+
+
 def test_seqtm_vocabulary():
     """Test SeqTM vocabulary"""
 
@@ -76,36 +97,30 @@ def test_seqtm_download():
     assert cdn == ['buenos', 'dias', 'mexico']
 
 
-def test_EncExp_filename():
+def test_EncExp_filename(es_mx_voc):
     """Test EncExp"""
-    if not isfile('encexp-es-mx.json.gz'):
-        samples()
-        data = compute_b4msa_vocabulary('es-mx-sample.json')
-        voc = compute_seqtm_vocabulary(SeqTM, data,
-                                       'es-mx-sample.json',
-                                       voc_size_exponent=10)
-        build_encexp(voc, 'es-mx-sample.json', 'encexp-es-mx.json.gz')
+    build_encexp(es_mx_voc, 'es-mx-sample.json', 'encexp-es-mx.json.gz')
     enc = EncExp(EncExp_filename='encexp-es-mx.json.gz')
     assert enc.weights.dtype == np.float32
     assert len(enc.names) == 11
     os.unlink('encexp-es-mx.json.gz')
     
 
-def test_EncExp():
+def test_EncExp(encexp_cache):
     """Test EncExp"""
     enc = EncExp(precision=np.float16)
     assert enc.weights.dtype == np.float16
     assert len(enc.names) == 8192
 
 
-def test_EncExp_encode():
+def test_EncExp_encode(encexp_cache):
     """Test EncExp encode"""
 
     dense = EncExp(precision=np.float16)
     assert dense.encode('buenos días').shape[1] == 2
 
 
-def test_EncExp_transform():
+def test_EncExp_transform(encexp_cache):
     """Test EncExp transform"""
 
     encexp = EncExp()
@@ -115,6 +130,17 @@ def test_EncExp_transform():
     assert X.dtype == np.float32
 
 
+def test_EncExp_encode_texts(encexp_cache):
+    """Test EncExp encode_texts"""
+
+    encexp = EncExp()
+    texts = ['buenos dias', 'buenos dias buenos dias', '']
+    X = encexp.encode_texts(texts)
+    for text, x in zip(texts, X):
+        assert_almost_equal(encexp.encode(text).sum(axis=1), x,
+                            decimal=4)
+
+
 # def test_EncExp_transform_float16():
 #     """Test EncExp transform (float16)"""
 
@@ -126,7 +152,7 @@ def test_EncExp_transform():
 #     assert X.dtype == np.float32
 
 
-def test_EncExp_prefix_suffix():
+def test_EncExp_prefix_suffix(encexp_cache):
     """Test EncExp prefix/suffix"""
 
     encexp = EncExp(lang='es',
@@ -140,13 +166,11 @@ def test_EncExp_prefix_suffix():
         assert k[3] == '~' or k[-1] == '~'
 
 
-def test_EncExp_fit():
+def test_EncExp_fit(mx_sample, ar_sample, encexp_cache):
     """Test EncExp fit"""
     from sklearn.svm import LinearSVC
-    samples()
-    mx = list(tweet_iterator('es-mx-sample.json'))
-    samples(filename='es-ar-sample.json.zip')
-    ar = list(tweet_iterator('es-ar-sample.json'))
+    mx = mx_sample
+    ar = ar_sample
     y = ['mx'] * len(mx)
     y += ['ar'] * len(ar)
     enc = EncExp(lang='es',
@@ -160,23 +184,15 @@ def test_EncExp_fit():
     assert df.dtype == np.float64
 
 
-def test_EncExp_fit_sgd():
+def test_EncExp_fit_sgd(mx_sample, ar_sample, encexp_cache):
     """Test EncExp fit"""
     from sklearn.linear_model import SGDClassifier
-    from itertools import repeat
-    samples()
-    mx = list(tweet_iterator('es-mx-sample.json'))
-    samples(filename='es-ar-sample.json.zip')
-    ar = list(tweet_iterator('es-ar-sample.json'))
+    mx = mx_sample
+    ar = ar_sample
     y = ['mx'] * len(mx)
     y += ['ar'] * len(ar)
-    D = mx + ar
-    # while len(D) < 2**17:
-    for i in range(5):
-        D.extend(D)
-        y.extend(y)
-    D.append(D[0])
-    y.append(y[0])
+    D = (mx + ar) * 32 + [mx[0]]
+    y = y * 32 + [y[0]]
     enc = EncExp(lang='es').fit(D, y)
     assert isinstance(enc.estimator, SGDClassifier)
     hy = enc.predict(ar)
@@ -186,14 +202,12 @@ def test_EncExp_fit_sgd():
     assert df.dtype == np.float64    
 
 
-def test_EncExp_train_predict_decision_function():
+def test_EncExp_train_predict_decision_function(mx_sample, ar_sample,
+                                                es_sample, encexp_cache):
     """Test EncExp train_predict_decision_function"""
-    samples()
-    mx = list(tweet_iterator('es-mx-sample.json'))
-    samples(filename='es-ar-sample.json.zip')
-    ar = list(tweet_iterator('es-ar-sample.json'))
-    samples(filename='es-es-sample.json.zip')
-    es = list(tweet_iterator('es-es-sample.json'))
+    mx = mx_sample
+    ar = ar_sample
+    es = es_sample
     y = ['mx'] * len(mx)
     y += ['ar'] * len(ar)
     enc = EncExp(lang='es',
@@ -206,7 +220,7 @@ def test_EncExp_train_predict_decision_function():
     assert hy.shape[1] == 3 and hy.shape[0] == len(y)
 
 
-def test_EncExp_clone():
+def test_EncExp_clone(encexp_cache):
     """Test EncExp clone"""
 
     enc = EncExp(lang='es', prefix_suffix=True,
@@ -216,7 +230,7 @@ def test_EncExp_clone():
     assert np.all(enc2.weights == enc.weights)
 
 
-def test_EncExp_merge_IDF():
+def test_EncExp_merge_IDF(encexp_cache):
     """Test EncExp without keyword's weight"""
 
     enc = EncExp(lang='es', prefix_suffix=True,
@@ -234,42 +248,26 @@ def test_EncExp_merge_IDF():
     assert_almost_equal(_, enc2.weights, decimal=5)
 
 
-def test_EncExp_fill():
+def test_EncExp_fill(encexp_es_mx):
     """Test EncExp fill weights"""
-    from encexp.download import download_seqtm
-
-    voc = download_seqtm(lang='es')
-    samples()
-    if not isfile('encexp-es-mx.json.gz'):
-        build_encexp(voc, 'es-mx-sample.json', 'encexp-es-mx.json.gz',
-                     min_pos=64)
-    enc = EncExp(EncExp_filename='encexp-es-mx.json.gz')
+    enc = EncExp(EncExp_filename=encexp_es_mx)
     iden = {v:k for k, v in enumerate(enc.bow.names)}
-    comp = [x for x in enc.bow.names if x not in enc.names]
+    comp = np.setdiff1d(enc.bow.names, enc.names, assume_unique=True)
     key = enc.names[0]
     enc.weights
     w = enc.fill()
     assert np.any(w[iden[key]] != 0)
     assert_almost_equal(w[iden[comp[0]]], 0)
-    os.unlink('encexp-es-mx.json.gz')
     assert np.all(enc.names == enc.bow.names)
 
 
-def test_EncExp_iadd():
+def test_EncExp_iadd(encexp_es_mx, encexp_cache):
     """Test EncExp iadd"""
 
-    from encexp.download import download_seqtm
-
-    voc = download_seqtm(lang='es')
-    samples()
-    if not isfile('encexp-es-mx.json.gz'):
-        build_encexp(voc, 'es-mx-sample.json', 'encexp-es-mx.json.gz',
-                     min_pos=64)
-    enc = EncExp(EncExp_filename='encexp-es-mx.json.gz')
+    enc = EncExp(EncExp_filename=encexp_es_mx)
     w = enc.weights
     enc += enc
     assert_almost_equal(w, enc.weights, decimal=4)
-    os.unlink('encexp-es-mx.json.gz')
     enc2 = EncExp(lang='es', voc_source='noGeo')
     enc2 += enc
     enc2 = EncExp(lang='es', voc_source='noGeo')
@@ -278,7 +276,18 @@ def test_EncExp_iadd():
     assert enc2.weights[0, 0] != 0
 
 
-def test_EncExp_force_tokens():
+def test_EncExp_bow_index(encexp_cache):
+    """Test the position of the components in the BoW"""
+
+    enc = EncExp(lang='es', prefix_suffix=True,
+                 precision=np.float16)
+    index = enc.bow_index
+    assert np.all(enc.bow.names[index[index >= 0]] == enc.names[index >= 0])
+    enc.names = enc.names[:2]
+    assert enc.bow_index.shape[0] == 2
+
+
+def test_EncExp_force_tokens(encexp_cache):
     """Test force tokens"""
 
     enc = EncExp(lang='es', prefix_suffix=True,
@@ -337,7 +346,7 @@ def test_SeqTM_jaja():
     assert txt == '~🧑~'
 
 
-def test_EncExp_enc_training_size():
+def test_EncExp_enc_training_size(encexp_cache):
     """Test training size of the embeddings"""
 
     enc = EncExp(lang='es')
@@ -346,7 +355,7 @@ def test_EncExp_enc_training_size():
         assert k in enc.names
 
 
-def test_EncExp_distance():
+def test_EncExp_distance(encexp_cache):
     """Test distance to hyperplane"""
 
     txt = 'buenos días'
@@ -358,7 +367,7 @@ def test_EncExp_distance():
     assert np.fabs(X - X2).sum() != 0
 
 
-def test_EncExp_unit_vector():
+def test_EncExp_unit_vector(encexp_cache):
     """Test distance to hyperplane"""
 
     txt = 'buenos días'
@@ -370,13 +379,11 @@ def test_EncExp_unit_vector():
     assert_almost_equal(np.linalg.norm(X), 1)
 
 
-def test_EncExp_build_tailored():
+def test_EncExp_build_tailored(mx_sample, ar_sample, encexp_cache):
     """Test the development of tailored models"""
 
-    samples()
-    mx = list(tweet_iterator('es-mx-sample.json'))
-    samples(filename='es-ar-sample.json.zip')
-    ar = list(tweet_iterator('es-ar-sample.json'))
+    mx = mx_sample
+    ar = ar_sample
     y = ['mx'] * len(mx)
     y += ['ar'] * len(ar)
 
@@ -394,12 +401,10 @@ def test_EncExp_build_tailored():
     assert hasattr(enc2, '_estimator')
     # os.unlink(enc.tailored)
 
-def test_pipeline_tm():
+def test_pipeline_tm(mx_sample, ar_sample):
     """Test Pipeline"""
-    samples()
-    mx = list(tweet_iterator('es-mx-sample.json'))
-    samples(filename='es-ar-sample.json.zip')
-    ar = list(tweet_iterator('es-ar-sample.json'))
+    mx = mx_sample
+    ar = ar_sample
     y = ['mx'] * len(mx)
     y += ['ar'] * len(ar)
 
@@ -425,17 +430,15 @@ def test_pipeline_tm():
     assert grid.best_score_ > 0.7
 
 
-def test_pipeline_encexp():
+def test_pipeline_encexp(mx_sample, ar_sample, encexp_cache):
     """Test Pipeline in EncExpT"""
     from sklearn.pipeline import Pipeline
     from sklearn.svm import LinearSVC
     from sklearn.model_selection import GridSearchCV
     from sklearn.model_selection import StratifiedShuffleSplit
 
-    samples()
-    mx = list(tweet_iterator('es-mx-sample.json'))
-    samples(filename='es-ar-sample.json.zip')
-    ar = list(tweet_iterator('es-ar-sample.json'))
+    mx = mx_sample
+    ar = ar_sample
     y = ['mx'] * len(mx)
     y += ['ar'] * len(ar)
 
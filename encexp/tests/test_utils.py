@@ -19,7 +19,7 @@ from numpy.testing import assert_almost_equal
 from microtc.utils import Counter, tweet_iterator
 from encexp.utils import Download, DialectID_URL, compute_b4msa_vocabulary
 from encexp.utils import compute_seqtm_vocabulary, unit_length
-from encexp.utils import set_to_zero, transform_from_tokens
+from encexp.utils import set_to_zero, transform_from_tokens, update_counter
 
 
 def test_download():
@@ -75,6 +75,56 @@ def test_compute_b4msa_vocabulary():
     assert counter.update_calls == 10
 
 
+def test_update_counter():
+    """Test update counter with a batch"""
+
+    counter = Counter()
+    batch = [set(['a', 'b']), set(['a'])]
+    update_counter(counter, batch)
+    assert counter.update_calls == 2
+    assert counter['a'] == 2 and counter['b'] == 1
+    assert len(batch) == 0
+    update_counter(counter, batch)
+    assert counter.update_calls == 2
+
+
+def test_json_iterator():
+    """Test json iterator"""
+    import gzip
+    from encexp.utils import json_iterator
+
+    samples()
+    D = list(tweet_iterator('es-mx-sample.json'))
+    assert list(json_iterator('es-mx-sample.json')) == D
+    with gzip.open('t.json.gz', 'wb') as fpt:
+        for d in D[:10]:
+            fpt.write(bytes(json.dumps(d) + '\n', encoding='utf-8'))
+    assert list(json_iterator('t.json.gz')) == D[:10]
+    os.unlink('t.json.gz')
+
+
+def test_most_common():
+    """Test most common with a partition"""
+    from encexp.utils import most_common
+
+    counter = Counter(dict(a=1, b=3, c=2, d=3, e=2, f=1))
+    for n in range(1, 8):
+        assert most_common(counter, n) == counter.most_common(n)
+
+
+def test_count_tokens():
+    """Test count tokens in parallel"""
+    from b4msa import TextModel
+    from encexp.utils import count_tokens, b4msa_params
+
+    samples()
+    text_model = TextModel(**b4msa_params(lang='es'))
+    counter = count_tokens(text_model, 'es-mx-sample.json')
+    counter2 = count_tokens(text_model, 'es-mx-sample.json', n_jobs=2)
+    assert counter.update_calls == counter2.update_calls
+    assert counter == counter2
+
+
 def test_uniform_sample():
     """Test uniform sample"""
 
@@ -14,6 +14,7 @@
 from dataclasses import dataclass
 from typing import Union
 from collections import OrderedDict
+from itertools import chain
 from sklearn.model_selection import StratifiedKFold
 from sklearn.base import clone
 from sklearn.linear_model import SGDClassifier
@@ -102,10 +103,9 @@ class TM(TextModel):
         try:
             return self._names
         except AttributeError:
-            _names = [None] * len(self.id2token)
-            for k, v in self.id2token.items():
-                _names[k] = v
-            self.names = np.array(_names)
+            id2token = self.id2token
+            self.names = np.array([id2token[k]
+                                   for k in range(len(id2token))])
             return self._names
 
     @names.setter
@@ -119,10 +119,11 @@ class TM(TextModel):
         try:
             return self._weights
         except AttributeError:
-            w = [None] * len(self.token_weight)
-            for k, v in self.token_weight.items():
-                w[k] = v
-            self.weights = np.array(w)
+            token_weight = self.token_weight
+            self.weights = np.fromiter((token_weight[k]
+                                        for k in range(len(token_weight))),
+                                       dtype=np.float64,
+                                       count=len(token_weight))
             return self._weights
 
     @weights.setter
@@ -142,17 +143,19 @@ class TM(TextModel):
         if not isinstance(X, list):
             return X
         assert self.num_terms is not None
-        data = []
-        row = []
-        col = []
-        for r, x in enumerate(X):
-            col.extend([i for i, _ in x])
-            data.extend([v for _, v in x])
-            _ = [r] * len(x)
-            row.extend(_)
-        return csr_matrix((data, (row, col)),
-                          shape=(len(X), self.num_terms),
-                          dtype=self.precision)
+        indptr = np.zeros(len(X) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter((len(x) for x in X), dtype=np.int64,
+                              count=len(X)),
+                  out=indptr[1:])
+        pairs = np.array(list(chain.from_iterable(X)),
+                         dtype=np.float64).reshape(-1, 2)
+        col = pairs[:, 0].astype(np.int64)
+        data = pairs[:, 1]
+        output = csr_matrix((data, col, indptr),
+                            shape=(len(X), self.num_terms),
+                            dtype=self.precision)
+        output.sort_indices()
+        return output
 
 
 class SeqTM(TM):
@@ -185,10 +188,58 @@ class SeqTM(TM):
         :rtype: set
         """
 
+        cache_size = self.cache_size
+        if cache_size:
+            cache = self.tokens_cache
+            tokens = cache.get(text)
+            if tokens is not None:
+                cache.move_to_end(text)
+                return [list(tokens)]
         get = self._map.get
         lst = self.find_token(text)
         _ = [text[a:b] for a, b in lst]
-        return [[get(x, x) for x in _]]
+        tokens = [get(x, x) for x in _]
+        if cache_size:
+            cache[text] = tuple(tokens)
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+        return [tokens]
+
+    def __getstate__(self):
+        """The tokens cache is not pickled"""
+
+        state = dict(self.__dict__)
+        state.pop('_tokens_cache', None)
+        return state
+
+    @property
+    def cache_size(self):
+        """Number of texts kept in :py:attr:`tokens_cache`;
+        0 (default) disables the cache"""
+
+        try:
+            return self._cache_size
+        except AttributeError:
+            self._cache_size = 0
+        return self._cache_size
+
+    @cache_size.setter
+    def cache_size(self, value):
+        self._cache_size = value
+        cache = self.tokens_cache
+        while len(cache) > value:
+            cache.popitem(last=False)
+
+    @property
+    def tokens_cache(self):
+        """Tokens of the last texts processed by :py:func:`compute_tokens`
+        (least recently used first)"""
+
+        try:
+            return self._tokens_cache
+        except AttributeError:
+            self._tokens_cache = OrderedDict()
+        return self._tokens_cache
 
     @property
     def tokens(self):
@@ -218,6 +269,7 @@ class SeqTM(TM):
     @data_structure.setter
     def data_structure(self, value):
         self._data_structure = value
+        self.tokens_cache.clear()
 
     def find_token(self, text):
         """Obtain the position of each label in the text
@@ -234,30 +286,30 @@ class SeqTM(TM):
         current = head
         text_length = len(text)
         while i < text_length:
-            char = text[i]
-            try:
-                current = current[char]
+            node = current.get(text[i])
+            if node is not None:
+                current = node
                 i += 1
-                if '__end__' in current:
-                    end = i
-                    if current['__end__'] is True:
-                        raise KeyError
-            except KeyError:
-                current = head
-                if end > init:
-                    blocks.append([init, end])
-                    if (end - init) >= 2 and text[end - 1] == '~':
-                        init = i = end = end - 1
-                    else:
-                        init = i = end
-                elif i > init:
-                    if (i - init) >= 2 and text[i - 1] == '~':
-                        init = end = i = i - 1
-                    else:
-                        init = end = i
+                if '__end__' not in node:
+                    continue
+                end = i
+                if node['__end__'] is not True:
+                    continue
+            current = head
+            if end > init:
+                blocks.append([init, end])
+                if (end - init) >= 2 and text[end - 1] == '~':
+                    init = i = end = end - 1
                 else:
-                    init += 1
-                    i = end = init
+                    init = i = end
+            elif i > init:
+                if (i - init) >= 2 and text[i - 1] == '~':
+                    init = end = i = i - 1
+                else:
+                    init = end = i
+            else:
+                init += 1
+                i = end = init
         if end > init:
             blocks.append([init, end])
         return blocks
@@ -314,20 +366,19 @@ class EncExpT:
 
     def force_tokens_weights(self, IDF: bool=False):
         """Set the maximum weight"""
-        # rows = np.arange(len(self.names))
-        rows = np.array([i for i, k in enumerate(self.names)
-                         if k in self.bow.token2id])
-
-        cols = np.array([self.bow.token2id[x] for x in self.names
-                         if x in self.bow.token2id])
+        cols = self.bow_index
+        rows = np.flatnonzero(cols >= 0)
+        cols = cols[rows]
         if cols.shape[0] == 0:
             return
+        weights = self.weights
         if IDF:
-            w = self.weights[rows][:, cols] * self.bow.weights[cols]
-            _max = (w.max(axis=1) / self.bow.weights[cols]).astype(self.precision)
+            idf = self.bow.weights[cols]
+            w = weights[np.ix_(rows, cols)] * idf
+            _max = (w.max(axis=1) / idf).astype(self.precision)
         else:
-            _max = self.weights[rows].max(axis=1)
-        self.weights[rows, cols] = _max
+            _max = weights[rows].max(axis=1)
+        weights[rows, cols] = _max
 
     @property
     def bias(self):
@@ -360,23 +411,29 @@ class EncExpT:
                                        prefix_suffix=self.prefix_suffix,
                                        intercept=self.intercept)
             self.bow = SeqTM(vocabulary=data['seqtm'])
-            w = self.bow.weights
-            weights = []
-            precision = self.precision
-            for vec in data['coefs']:
-                if not self.merge_IDF:
-                    coef = vec['coef']
-                else:
-                    coef = (vec['coef'] * w).astype(precision)
-                weights.append(coef)
-            self.weights = np.vstack(weights)
+            coefs = data['coefs']
+            dtype = coefs[0]['coef'].dtype
+            if self.merge_IDF:
+                dtype = self.precision
+                w = self.bow.weights
+            weights = np.empty((len(coefs), coefs[0]['coef'].shape[0]),
+                               dtype=dtype, order='F')
+            # rows are stacked in small blocks so the block stays in cache
+            # while it is scattered into the Fortran-ordered matrix
+            for start in range(0, len(coefs), 64):
+                block = np.stack([vec['coef']
+                                  for vec in coefs[start:start + 64]])
+                if self.merge_IDF:
+                    block = np.multiply(block, w, dtype=dtype,
+                                        casting='unsafe')
+                weights[start:start + 64] = block
+            self.weights = weights
             self.bias = np.array([vec['intercept'] for vec in data['coefs']],
                                  dtype=self.precision)
             self.names = np.array([vec['label'] for vec in data['coefs']])
             self.enc_training_size = {vec['label']: vec['N'] for vec in data['coefs']}
             if self.force_token:
                 self.force_tokens_weights(IDF=self.intercept)
-        self.weights = np.asarray(self._weights, order='F')
         return self._weights
 
     @property
@@ -404,7 +461,7 @@ class EncExpT:
 
     @weights.setter
     def weights(self, value):
-        self._weights = value
+        self._weights = np.asarray(value, order='F')
 
     @property
     def names(self):
@@ -418,6 +475,7 @@ class EncExpT:
     @names.setter
     def names(self, value):
         self._names = value
+        self.__dict__.pop('_bow_index', None)
 
     @property
     def bow(self):
@@ -431,6 +489,19 @@ class EncExpT:
     @bow.setter
     def bow(self, value):
         self._bow = value
+        self.__dict__.pop('_bow_index', None)
+
+    @property
+    def bow_index(self):
+        """Position of each component in the BoW; -1 when it is not a token"""
+        try:
+            return self._bow_index
+        except AttributeError:
+            get = self.bow.token2id.get
+            names = self.names
+            self._bow_index = np.fromiter((get(x, -1) for x in names),
+                                          dtype=np.int64, count=len(names))
+        return self._bow_index
 
     def encode(self, text):
         """Encode utterace into a matrix"""
@@ -447,21 +518,50 @@ class EncExpT:
             return np.ones((W.shape[0], 1), dtype=W.dtype)
         return W[:, seq]
 
+    def encode_texts(self, texts):
+        """Sum of the encoding of each text; the token counts are
+        multiplied by the weights, only the columns used in the
+        texts are upcasted when the weights are float16"""
+
+        from scipy.sparse import csr_matrix
+
+        token2id = self.bow.token2id
+        tokenize = self.bow.tokenize
+        seq = []
+        indptr = [0]
+        for data in progress_bar(texts, total=len(texts),
+                                 desc='Transform',
+                                 use_tqdm=self.progress_bar):
+            seq.extend([token2id[token] for token in tokenize(data)
+                        if token in token2id])
+            indptr.append(len(seq))
+        seq = np.array(seq, dtype=np.int64)
+        W = self.weights
+        dtype = np.promote_types(W.dtype, np.float32)
+        if W.dtype == dtype:
+            W_used = W.T
+        else:
+            cols, seq = np.unique(seq, return_inverse=True)
+            W_used = W[:, cols].T.astype(dtype)
+        counts = csr_matrix((np.ones(seq.shape[0], dtype=dtype),
+                             seq, indptr),
+                            shape=(len(indptr) - 1, W_used.shape[0]))
+        X = np.asarray(counts @ W_used, dtype=W.dtype)
+        X[np.diff(indptr) == 0] = 1
+        return X
+
     def transform(self, texts):
         """Represents the texts into a matrix"""
         if self.intercept:
             X = self.bow.transform(texts) @ self.weights.T + self.bias
         else:
-            X = np.r_[[self.encode(data).sum(axis=1)
-                      for data in progress_bar(texts, total=len(texts),
-                                               desc='Transform',
-                                               use_tqdm=self.progress_bar)]]
+            X = self.encode_texts(texts)
         if self.transform_distance:
-            X = X / self.weights_norm
+            X /= self.weights_norm
         if self.unit_vector:
             _norm = norm(X, axis=1)
             _norm[_norm == 0] = 1
-            return X / np.c_[_norm]
+            X /= np.c_[_norm]
         return X
 
     def fill(self, inplace: bool=True, names: list=None):
@@ -469,11 +569,16 @@ class EncExpT:
         weights = self.weights
         if names is None:
             names = self.bow.names
+            rows = self.bow_index
+            if np.any(rows < 0):
+                raise KeyError(self.names[np.argmin(rows)])
+        else:
+            iden = {v: k for k, v in enumerate(names)}
+            rows = np.fromiter((iden[key] for key in self.names),
+                               dtype=np.int64, count=len(self.names))
         w = np.zeros((len(names), weights.shape[1]),
                      dtype=self.precision)
-        iden = {v: k for k, v in enumerate(names)}
-        for key, value in zip(self.names, weights):
-            w[iden[key]] = value
+        w[rows] = weights
         if inplace:
             self.weights = w
             self.names = names
@@ -527,35 +632,25 @@ class EncExpT:
         """Add weights"""
 
         assert np.all(self.bow.names == other.bow.names)
-        _ = self.precision == np.float32
-        weights_ = self.weights if _ else self.weights.astype(np.float32)
-        _ = other.precision == np.float32
-        w_other = other.weights if _ else other.weights.astype(np.float32)
+        weights_ = self.weights.astype(np.float32, copy=False)
+        w_other = other.weights.astype(np.float32, copy=False)
         w_norm = np.linalg.norm(weights_, axis=1)
         other_norm = np.linalg.norm(w_other, axis=1)
-        w = dict(zip(self.names, weights_ / np.c_[w_norm]))
-        w_other = dict(zip(other.names, w_other / np.c_[other_norm]))
-        w_norm = dict(zip(self.names, w_norm))
-        other_norm = dict(zip(other.names, other_norm))
-        names = sorted(set(self.names).union(set(other.names)))
-        weights = []
-        norms = []
-        for name in names:
-            if name in w and name in w_other:
-                _ = (w[name] + w_other[name]) / 2
-                weights.append(_)
-                norms.append(w_norm[name])
-            elif name in w:
-                weights.append(w[name])
-                norms.append(w_norm[name])
-            else:
-                weights.append(w_other[name])
-                norms.append(other_norm[name])
-        weights = np.asarray(weights, order='F')
-        weights = weights / np.c_[np.linalg.norm(weights, axis=1)]
-        self.weights = np.asarray(weights * np.c_[np.array(norms)],
-                                  dtype=self.precision, order='F')
-        self.names = np.array(names)
+        names = np.union1d(self.names, other.names)
+        rows = np.searchsorted(names, self.names)
+        rows_other = np.searchsorted(names, other.names)
+        weights = np.zeros((names.shape[0], weights_.shape[1]),
+                           dtype=np.float32)
+        weights[rows_other] = w_other / np.c_[other_norm]
+        weights[rows] += weights_ / np.c_[w_norm]
+        norms = np.empty(names.shape[0], dtype=np.float32)
+        norms[rows_other] = other_norm
+        norms[rows] = w_norm
+        weights /= np.c_[np.linalg.norm(weights, axis=1)]
+        weights *= np.c_[norms]
+        self.weights = np.asarray(weights, dtype=self.precision,
+                                  order='F')
+        self.names = names
         return self
 
     def __sklearn_clone__(self):
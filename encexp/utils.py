@@ -12,7 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-from itertools import count
+from functools import lru_cache
+from itertools import chain
 from urllib import request
 from urllib.error import HTTPError
 try:
@@ -20,7 +21,13 @@ try:
     from tqdm import tqdm
 except ImportError:
     USE_TQDM = False
-from microtc.utils import tweet_iterator, Counter
+try:
+    USE_ORJSON = True
+    import orjson
+except ImportError:
+    USE_ORJSON = False
+from joblib import Parallel, delayed, effective_n_jobs
+from microtc.utils import Counter
 from microtc import emoticons
 from b4msa import TextModel
 import numpy as np
@@ -34,6 +41,8 @@ DialectID_URL = 'https://github.com/INGEOTEC/dialectid/releases/download/data'
 EncExp_URL = 'https://github.com/INGEOTEC/EncExp/releases/download/data'
 MODELS = os.path.join(os.path.dirname(__file__),
                       'models')
+BATCH_SIZE = 2**14
+COMPRESSLEVEL = 6
 
 class Download(object):
     """Download
@@ -46,6 +55,8 @@ class Download(object):
         self._url = url
         self._output = output
         self._use_tqdm = USE_TQDM
+        self._total = -1
+        self._read = 0
         try:
             request.urlretrieve(url, output, reporthook=self.progress)
         except HTTPError as exc:
@@ -63,7 +74,9 @@ class Download(object):
         try:
             return self._tqdm
         except AttributeError:
-            self._tqdm = tqdm(total=self._nblocks,
+            total = self._total if self._total > 0 else None
+            self._tqdm = tqdm(total=total, unit='B', unit_scale=True,
+                              mininterval=0.5,
                               leave=False, desc=self._output)
         return self._tqdm
 
@@ -72,16 +85,48 @@ class Download(object):
         if self._use_tqdm:
             self.tqdm.close()
 
-    def update(self):
+    def update(self, n=1):
         """Update tqdm if used"""
         if self._use_tqdm:
-            self.tqdm.update()
+            self.tqdm.update(n)
 
     def progress(self, nblocks, block_size, total):
-        """tqdm progress"""
+        """tqdm progress; it is measured in bytes"""
+
+        self._total = total
+        read = nblocks * block_size
+        if total > 0:
+            read = min(read, total)
+        self.update(read - self._read)
+        self._read = read
+
+
+def json_dumps(data):
+    """JSON representation (bytes); it uses orjson when available"""
 
-        self._nblocks = total // block_size
-        self.update()
+    if USE_ORJSON:
+        return orjson.dumps(data)
+    return bytes(json.dumps(data), encoding='utf-8')
+
+
+def json_loads(data):
+    """Parse a JSON document; it uses orjson when available"""
+
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_iterator(filename):
+    """Iterate over the JSON documents (one per line) of the file"""
+
+    opener = gzip.open if filename[-3:] == '.gz' else open
+    with opener(filename, 'rb') as fpt:
+        for line in fpt:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            yield json_loads(line)
 
 
 def b4msa_params(lang='es'):
@@ -121,27 +166,124 @@ def progress_bar(data, total=np.inf,
         return data
     if total == np.inf:
         total = None
+    kwargs.setdefault('mininterval', 0.5)
     return tqdm(data, total=total, **kwargs)
 
 
+def most_common(counter, n):
+    """Equivalent to `counter.most_common(n)` (ties are kept in
+    insertion order); the n elements are selected with a partition"""
+
+    if n >= len(counter):
+        return counter.most_common()
+    keys = list(counter.keys())
+    values = np.array(list(counter.values()))
+    kth = values.shape[0] - n
+    threshold = np.partition(values, kth)[kth]
+    above = np.where(values > threshold)[0]
+    tie = np.where(values == threshold)[0][:n - above.shape[0]]
+    index = np.sort(np.concatenate((above, tie)))
+    index = index[np.argsort(-values[index], kind='stable')]
+    return [(keys[i], counter[keys[i]]) for i in index]
+
+
+def update_counter(counter, batch):
+    """Update the counter with a batch of tokens (one list or set
+    per text); each element of the batch counts as an update call"""
+
+    if len(batch) == 0:
+        return counter
+    update_calls = counter.update_calls + len(batch)
+    counter.update(chain.from_iterable(batch))
+    counter.update_calls = update_calls
+    batch.clear()
+    return counter
+
+
+def unique_tokens(text_model, maxsize=2**12):
+    """Function that returns the unique tokens of a tweet;
+    the tokens of the last `maxsize` distinct texts are cached,
+    each entry can hold hundreds of q-grams"""
+
+    tokenize = text_model.tokenize
+    get_text = text_model.get_text
+
+    @lru_cache(maxsize=maxsize)
+    def cached(text):
+        return dict.fromkeys(tokenize(text))
+
+    def inner(tweet):
+        return cached(get_text(tweet))
+    return inner
+
+
+def count_tokens_chunk(text_model, filename, start, end):
+    """Count the tokens of the tweets whose line starts
+    in the byte range [start, end) of the file"""
+
+    tokenize = unique_tokens(text_model)
+    counter = Counter()
+    batch = []
+    with open(filename, 'rb') as fpt:
+        if start > 0:
+            fpt.seek(start - 1)
+            fpt.readline()
+        while fpt.tell() < end:
+            line = fpt.readline()
+            if not line:
+                break
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            batch.append(tokenize(json_loads(line)))
+            if len(batch) == BATCH_SIZE:
+                update_counter(counter, batch)
+    return update_counter(counter, batch)
+
+
+def count_tokens(text_model, filename, limit=None, n_jobs=1):
+    """Count the number of tweets where each token appears"""
+
+    n_jobs = effective_n_jobs(n_jobs)
+    if n_jobs > 1 and limit is None and filename[-3:] != '.gz':
+        size = os.path.getsize(filename)
+        chunks = [(i * size // n_jobs, (i + 1) * size // n_jobs)
+                  for i in range(n_jobs)]
+        parts = Parallel(n_jobs=n_jobs)(delayed(count_tokens_chunk)(text_model,
+                                                                    filename,
+                                                                    start, end)
+                                        for start, end in progress_bar(chunks,
+                                                                       desc=filename))
+        counter = Counter()
+        for part in parts:
+            counter.update(part)
+        counter.update_calls = sum([part.update_calls for part in parts])
+        return counter
+    tokenize = unique_tokens(text_model)
+    if limit is None:
+        tweets = json_iterator(filename)
+    else:
+        tweets = (tweet for tweet, _ in zip(json_iterator(filename),
+                                            range(limit)))
+    counter = Counter()
+    batch = []
+    for tweet in progress_bar(tweets, total=np.inf if limit is None else limit,
+                              desc=filename):
+        batch.append(tokenize(tweet))
+        if len(batch) == BATCH_SIZE:
+            update_counter(counter, batch)
+    return update_counter(counter, batch)
+
+
 def compute_b4msa_vocabulary(filename, limit=None, lang='es',
-                             **kwargs):
+                             n_jobs=1, **kwargs):
     """Compute the vocabulary"""
 
     params = b4msa_params(lang=lang)
     params.update(kwargs)
-    tokenize = replace_tokens(TextModel(**params)).tokenize
-    if limit is None:
-        limit = np.inf
-    counter = Counter()
-    if limit == np.inf:
-        loop = count()
-    else:
-        loop = range(limit)
-    for tweet, _ in progress_bar(zip(tweet_iterator(filename),
-                                        loop), total=limit,
-                                        desc=filename):
-        counter.update(set(tokenize(tweet)))
+    text_model = replace_tokens(TextModel(**params))
+    counter = count_tokens(text_model, filename, limit=limit,
+                           n_jobs=n_jobs)
     _ = dict(update_calls=counter.update_calls,
              dict=dict(counter.most_common()))
     data = dict(counter=_, params=params)
@@ -151,7 +293,8 @@ def compute_b4msa_vocabulary(filename, limit=None, lang='es',
 def compute_seqtm_vocabulary(instance, vocabulary,
                              filename, limit=None,
                              voc_size_exponent=13,
-                             prefix_suffix=False):
+                             prefix_suffix=False,
+                             n_jobs=1):
     """Compute SeqTM"""
 
     def current_lost_words():
@@ -160,15 +303,19 @@ def compute_seqtm_vocabulary(instance, vocabulary,
         lost =  words[2**voc_size_exponent:]
         return current, lost
 
-    def tokenizer(length, current):
-        length += 2
-        cnt = Counter()
+    def qgrams_by_length(lengths):
+        qgrams = {length: {} for length in lengths}
         for k, v in base_voc.items():
-            if k[:2] != 'q:' or len(k) != length:
+            if k[:2] != 'q:' or len(k) not in qgrams:
                 continue
+            length = len(k)
             if prefix_suffix and length < 6 and k[3] != '~' and k[-1] != '~':
                 continue
-            cnt[k] = v
+            qgrams[length][k] = v
+        return qgrams
+
+    def tokenizer(qgrams, current):
+        cnt = Counter(qgrams)
         for token in current:
             freq = base_voc[token]
             if freq == 0:
@@ -184,33 +331,31 @@ def compute_seqtm_vocabulary(instance, vocabulary,
         lengths = sorted([length
                           for length in vocabulary['params']['token_list']
                           if length > 0], reverse=True)
+        qgrams = qgrams_by_length([length + 2 for length in lengths])
         for length in progress_bar(lengths, desc='qgrams'):
-            tokenize = tokenizer(length, current)
+            tokenize = tokenizer(qgrams[length + 2], current)
             cnt = Counter()
-            vacia = set(['~'])
+            get = cnt.get
             for word in words:
-                tokens = set(tokenize(word)) - vacia
-                _ = {token: base_voc[word] for token in tokens}
-                cnt.update(_)
-            current = [k for k, v in cnt.most_common(n=2**voc_size_exponent)]
-        return cnt.most_common(n=2**voc_size_exponent)
-
-    limit = np.inf if limit is None else limit
-    loop = count() if limit == np.inf else range(limit)
+                freq = base_voc[word]
+                tokens = dict.fromkeys(token for token in tokenize(word)
+                                       if token != '~')
+                for token in tokens:
+                    cnt[token] = get(token, 0) + freq
+            voc = most_common(cnt, 2**voc_size_exponent)
+            current = [k for k, v in voc]
+        return voc
+
     base_voc = Counter(vocabulary['counter']["dict"],
                        vocabulary['counter']["update_calls"])
     voc = optimize_vocabulary()
     cnt = Counter(dict(voc),
                   update_calls=base_voc.update_calls)
     _ = dict(params=vocabulary['params'], counter=cnt)
-    tokenize = instance(vocabulary=_).tokenize
-    counter = Counter()
-    for tweet, _ in progress_bar(zip(tweet_iterator(filename),
-                                        loop), total=limit,
-                                        desc=filename):
-        counter.update(set(tokenize(tweet)))
+    counter = count_tokens(instance(vocabulary=_), filename, limit=limit,
+                           n_jobs=n_jobs)
     _ = dict(update_calls=counter.update_calls,
-             dict=dict(counter.most_common()[:2**voc_size_exponent]))
+             dict=dict(most_common(counter, 2**voc_size_exponent)))
     data = dict(counter=_, params=vocabulary['params'])
     return data
 
@@ -224,8 +369,7 @@ def uniform_sample(N, avail_data):
         if index.shape[0] == 0:
             break
         sample = np.random.randint(index.shape[0], size=N - M)
-        sample_i, sample_cnt = np.unique(index[sample], return_counts=True)
-        remaining[sample_i] = remaining[sample_i] - sample_cnt
+        remaining[index] -= np.bincount(sample, minlength=index.shape[0])
         remaining[remaining < 0] = 0
         M = (avail_data - remaining).sum()
     return avail_data - remaining
@@ -245,17 +389,16 @@ def set_to_zero(data, percentage: float=0.95):
     if percentage == 1:
         data[data < 0] = 0
         return data
-    ss = np.argsort(data, axis=0)[::-1]
+    srt = np.sort(data, axis=0)[::-1]
     tot = data.sum(axis=0)
     tot[tot == 0] = 1
-    cum = np.cumsum(np.take_along_axis(data / tot,
-                                       ss, axis=0), axis=0)
+    cum = np.cumsum(srt / tot, axis=0)
     a, b = np.where(np.diff(cum <= percentage,
                             axis=0))
     a += 1
     _ = b.argsort()
     a, b = a[_], b[_]
-    values = data[ss[a, b], b]
+    values = srt[a, b]
     if values.shape[0] != data.shape[0]:
         a_n = np.zeros(data.shape[0], dtype=values.dtype)
         a_n[b] = values